@@ -24,6 +24,7 @@
 
 from geoip import geolite2
 from datetime import datetime
+import calendar
 import ipaddress
 import json
 import os.path
@@ -31,8 +32,21 @@ import sys
 import socket
 from collections import namedtuple
 
+from NetHunt_Rollup import RollupStore
+
 Pair = namedtuple('Pair', 'src dest')
 
+def HumanSize(size):
+    # Calculate a human readable size of the traffic
+    if size < 1024:
+        return "%dB" % size
+    elif size / 1024. < 1024:
+        return "%.2fK" % (size / 1024.)
+    elif size / 1024.**2 < 1024:
+        return "%.2fM" % (size / 1024.**2)
+    else:
+        return "%.2fG" % (size / 1024.**3)
+
 def FetchIPs(flow):
     if flow['IP_PROTOCOL_VERSION'] == 4:
         return Pair(
@@ -79,15 +93,7 @@ class Connection:
 
     @property
     def human_size(self):
-        # Calculate a human readable size of the traffic
-        if self.size < 1024:
-            return "%dB" % self.size
-        elif self.size / 1024. < 1024:
-            return "%.2fK" % (self.size / 1024.)
-        elif self.size / 1024.**2 < 1024:
-            return "%.2fM" % (self.size / 1024.**2)
-        else:
-            return "%.2fG" % (self.size / 1024.**3)
+        return HumanSize(self.size)
 
     @property
     def human_duration(self):
@@ -125,7 +131,39 @@ class Connection:
         return service
 
 
+def ParseTime(value):
+    # Rollup buckets are aligned to UTC, so are the query boundaries
+    for fmt in ("%Y-%m-%d %H:%M", "%Y-%m-%d"):
+        try:
+            return calendar.timegm(datetime.strptime(value, fmt).timetuple())
+        except ValueError:
+            pass
+    exit("Cannot parse time {}, please use YYYY-MM-DD[ HH:MM] (UTC)".format(value))
+
+
+def RollupReport(path, start, end):
+    # Report from the coarsest rollup tiers able to answer the range
+    tiers, rows = RollupStore(path).query(start, end)
+    print("Using {} rollup tiers".format(", ".join(tier.name for tier in tiers)))
+    for row in rows:
+        try:
+            service = socket.getservbyport(row.port)
+        except (OSError, OverflowError):
+            service = "unknown"
+        timestamp = datetime.utcfromtimestamp(row.bucket).strftime("%Y-%m-%d %H:%M.%S")
+        print("{timestamp}: {service:7} | {size:8} | {flows:6} flows | {src} to {dest}".format(
+            timestamp=timestamp, service=service.upper(), size=HumanSize(row.bytes),
+            flows=row.flows, src=row.src, dest=row.dest))
+
+
 # Handle CLI args and load the data dump
+if len(sys.argv) > 1 and sys.argv[1] == "--rollup":
+    if len(sys.argv) != 5:
+        exit("Please use as {} --rollup <rollup dir> <start> <end>".format(sys.argv[0]))
+    if not os.path.isdir(sys.argv[2]):
+        exit("Directory {} does not exist!".format(sys.argv[2]))
+    RollupReport(sys.argv[2], ParseTime(sys.argv[3]), ParseTime(sys.argv[4]))
+    exit()
 if len(sys.argv) < 2:
     exit("In correct usage of the PwC:(NetHunt™) Analysis tool. Please use as {} <DateStamp>.json".format(sys.argv[0]))
 filename = sys.argv[1]
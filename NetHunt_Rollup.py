@@ -0,0 +1,443 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  NetHunt_Rollup.py
+#  PwC:(NetHunt™)
+#  Copyright 2018 raja <raja@raja-Inspiron-N5110>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+
+"""
+Downsampled rollup tiers for long-term flow retention.
+
+main.py writes raw flows into JSON segments named <segment start>.json.
+Once a segment is closed, its flows are folded into the 1 minute tier.
+The 1 hour and 1 day tiers are rebuilt from the next finer tier once a
+bucket can no longer change. All tiers are keyed by source prefix,
+destination prefix, service port and protocol, stored as gzipped JSON
+partitions and expire old partitions according to their own retention.
+
+Queries read every part of the requested time range from the coarsest
+tier which has already completed it.
+"""
+
+import gzip
+import ipaddress
+import json
+import logging
+import os
+import os.path
+import threading
+import time
+from collections import namedtuple
+
+# Prefix lengths used to group addresses
+IPV4_PREFIX = 24
+IPV6_PREFIX = 64
+
+# name: directory name, resolution: bucket size in seconds,
+# partition: seconds covered by one file, retention: seconds or None (forever)
+Tier = namedtuple('Tier', 'name resolution partition retention')
+
+DAY = 86400
+
+# Rolled up raw segments are deleted after this many seconds by default
+RAW_RETENTION = 7 * DAY
+
+# Ordered from finest to coarsest, each resolution a multiple of the
+# previous one. Partitions are kept small so that every rewrite stays
+# proportional to the data that changed.
+TIERS = (
+    Tier('1m', 60, 3600, 14 * DAY),
+    Tier('1h', 3600, DAY, 400 * DAY),
+    Tier('1d', DAY, 30 * DAY, None),
+)
+
+# bucket, src prefix, dst prefix, port, protocol
+Key = namedtuple('Key', 'bucket src dest port protocol')
+# bytes, packets, flows
+Row = namedtuple('Row', 'bucket src dest port protocol bytes packets flows')
+
+
+def prefix_of(flow, direction):
+    """Return the network prefix of the SRC or DST address of a raw flow."""
+    if flow.get('IP_PROTOCOL_VERSION') == 6:
+        addr = flow.get('IPV6_{}_ADDR'.format(direction))
+        address, network, length = ipaddress.IPv6Address, ipaddress.IPv6Network, IPV6_PREFIX
+    else:
+        addr = flow.get('IPV4_{}_ADDR'.format(direction))
+        address, network, length = ipaddress.IPv4Address, ipaddress.IPv4Network, IPV4_PREFIX
+    if addr is None:
+        return "unknown"
+    # Addresses may be exported as strings or as plain integers
+    try:
+        return network((address(addr), length), strict=False).compressed
+    except ValueError:
+        return "unknown"
+
+
+def service_port(flow):
+    # The lower of both ports is most likely the service, the other one
+    # an ephemeral client port
+    ports = [flow.get('L4_SRC_PORT', 0), flow.get('L4_DST_PORT', 0)]
+    ports = [p for p in ports if p] or [0]
+    return min(ports)
+
+
+def aggregate(exports, resolution):
+    """Aggregate raw exports ({timestamp: [flow, ...]}) into buckets."""
+    totals = {}
+    for export, flows in exports.items():
+        bucket = int(float(export)) // resolution * resolution
+        for flow in flows:
+            key = Key(bucket, prefix_of(flow, 'SRC'), prefix_of(flow, 'DST'),
+                      service_port(flow), flow.get('PROTOCOL', 0))
+            counters = totals.setdefault(key, [0, 0, 0])
+            counters[0] += flow.get('IN_BYTES', 0)
+            counters[1] += flow.get('IN_PKTS', 0)
+            counters[2] += 1
+    return totals
+
+
+class RollupStore:
+    """On-disk storage of all rollup tiers below a single directory."""
+
+    def __init__(self, path, tiers=TIERS):
+        self.path = path
+        self.tiers = tiers
+        self.state_file = os.path.join(path, "state.json")
+
+    def create(self):
+        # Only the writing side creates directories, queries stay read only
+        for tier in self.tiers:
+            os.makedirs(os.path.join(self.path, tier.name), exist_ok=True)
+
+    def _partition_file(self, tier, start):
+        return os.path.join(self.path, tier.name, "{}.json.gz".format(start))
+
+    def _partitions(self, tier):
+        # Yields (start, path) of every partition of a tier
+        directory = os.path.join(self.path, tier.name)
+        if not os.path.isdir(directory):
+            return
+        for name in sorted(os.listdir(directory)):
+            if not name.endswith(".json.gz"):
+                continue
+            yield int(name[:-len(".json.gz")]), os.path.join(directory, name)
+
+    def _read(self, path):
+        if not os.path.exists(path):
+            return {}
+        with gzip.open(path, 'rt') as fh:
+            return {Key(*row[:5]): row[5:] for row in json.loads(fh.read())}
+
+    def _write_tmp(self, path, totals):
+        rows = sorted(list(key) + counters for key, counters in totals.items())
+        tmp = path + ".tmp"
+        with gzip.open(tmp, 'wt') as fh:
+            fh.write(json.dumps(rows, separators=(',', ':')))
+        return tmp
+
+    def _write(self, path, totals):
+        # Readers never see a half written partition
+        os.replace(self._write_tmp(path, totals), path)
+
+    def load_state(self):
+        state = {}
+        if os.path.exists(self.state_file):
+            with open(self.state_file, 'r') as fh:
+                state = json.loads(fh.read())
+        # rolled_up_to: start of the last rolled up raw segment, dirty:
+        # buckets per tier which need a rebuild, pending: [tmp, partition]
+        # renames of a merge, complete: per tier time up to which no bucket
+        # can change anymore
+        state.setdefault("rolled_up_to", 0)
+        state.setdefault("dirty", {})
+        state.setdefault("pending", [])
+        state.setdefault("complete", {})
+        return state
+
+    def save_state(self, state):
+        tmp = self.state_file + ".tmp"
+        with open(tmp, 'w') as fh:
+            fh.write(json.dumps(state))
+        os.replace(tmp, self.state_file)
+
+    def recover(self, state):
+        """Finish the renames of a merge which was interrupted after its state was saved."""
+        if not state["pending"]:
+            return
+        for tmp, path in state["pending"]:
+            if os.path.exists(tmp):
+                os.replace(tmp, path)
+        state["pending"] = []
+        self.save_state(state)
+
+    def _mark_dirty(self, state, tier, buckets):
+        dirty = set(state["dirty"].get(tier.name, []))
+        dirty.update(bucket // tier.resolution * tier.resolution for bucket in buckets)
+        state["dirty"][tier.name] = sorted(dirty)
+
+    def merge(self, segment, totals, state):
+        """Add the finest tier totals of the segment starting at segment to the store.
+
+        The touched partitions are written to temporary files first. They
+        are only renamed after state.json records the segment along with
+        the pending renames, so an interrupted merge is either redone by
+        recover() or not counted at all.
+        """
+        tier = self.tiers[0]
+        partitions = {}
+        for key, counters in totals.items():
+            start = key.bucket // tier.partition * tier.partition
+            partitions.setdefault(start, {})[key] = counters
+
+        pending = []
+        for start, new in partitions.items():
+            path = self._partition_file(tier, start)
+            existing = self._read(path)
+            for key, counters in new.items():
+                current = existing.setdefault(key, [0, 0, 0])
+                for i, value in enumerate(counters):
+                    current[i] += value
+            pending.append([self._write_tmp(path, existing), path])
+
+        state["rolled_up_to"] = segment
+        state["pending"] = pending
+        if len(self.tiers) > 1:
+            self._mark_dirty(state, self.tiers[1], [key.bucket for key in totals])
+        self.save_state(state)
+        self.recover(state)
+
+    def _finer_files(self, tier, finer, bucket):
+        # Partitions of finer which cover a bucket of tier
+        first = bucket // finer.partition * finer.partition
+        return [self._partition_file(finer, start)
+                for start in range(first, bucket + tier.resolution, finer.partition)]
+
+    def _rebuild(self, tier, finer, bucket):
+        """Replace a bucket of tier with the sum of finer's buckets inside it.
+
+        Returns False without touching anything if none of the finer
+        partitions exist any more.
+        """
+        end = bucket + tier.resolution
+        files = [path for path in self._finer_files(tier, finer, bucket) if os.path.exists(path)]
+        if not files:
+            return False
+        totals = {}
+        for path in files:
+            for key, counters in self._read(path).items():
+                if bucket <= key.bucket < end:
+                    current = totals.setdefault(key._replace(bucket=bucket), [0, 0, 0])
+                    for i, value in enumerate(counters):
+                        current[i] += value
+
+        path = self._partition_file(tier, bucket // tier.partition * tier.partition)
+        existing = {key: counters for key, counters in self._read(path).items()
+                    if key.bucket != bucket}
+        existing.update(totals)
+        if existing or os.path.exists(path):
+            self._write(path, existing)
+        return True
+
+    def compact(self, state, cutoff):
+        """Rebuild dirty buckets of the coarser tiers ending before cutoff.
+
+        A rebuilt bucket replaces its previous rows, so repeating a rebuild
+        after a crash or a late segment never counts anything twice.
+        Afterwards the complete watermark of every tier is updated.
+        """
+        for finer, tier, coarser in zip(self.tiers, self.tiers[1:], tuple(self.tiers[2:]) + (None,)):
+            dirty = state["dirty"].get(tier.name, [])
+            ready = [bucket for bucket in dirty if bucket + tier.resolution <= cutoff]
+            if not ready:
+                continue
+            for bucket in ready:
+                if not self._rebuild(tier, finer, bucket):
+                    # The finer data is already gone, keep what we have
+                    logging.warning("Not rebuilding {} bucket {}, no {} data left".format(
+                        tier.name, bucket, finer.name))
+            state["dirty"][tier.name] = [bucket for bucket in dirty if bucket not in ready]
+            if coarser is not None:
+                self._mark_dirty(state, coarser, ready)
+            self.save_state(state)
+
+        complete = cutoff
+        for tier in self.tiers:
+            complete = min([complete // tier.resolution * tier.resolution] +
+                           state["dirty"].get(tier.name, []))
+            state["complete"][tier.name] = complete
+        self.save_state(state)
+
+    def expire(self, state, now=None):
+        """Remove partitions which are entirely outside of their tier's retention.
+
+        Partitions a dirty bucket of the next coarser tier still has to be
+        rebuilt from are kept until that rebuild happened.
+        """
+        now = time.time() if now is None else now
+        for tier, coarser in zip(self.tiers, tuple(self.tiers[1:]) + (None,)):
+            if tier.retention is None:
+                continue
+            needed = set()
+            if coarser is not None:
+                for bucket in state["dirty"].get(coarser.name, []):
+                    needed.update(self._finer_files(coarser, tier, bucket))
+            for start, path in self._partitions(tier):
+                if path in needed:
+                    continue
+                if start + tier.partition <= now - tier.retention:
+                    logging.debug("Expiring rollup partition {}".format(path))
+                    os.remove(path)
+
+    def plan(self, start, end, now=None):
+        """Split [start, end) into (tier, start, end) parts to read.
+
+        Each part is read from the coarsest tier whose buckets line up with
+        it, whose retention covers it and whose complete watermark in
+        state.json lies past it. Whatever no tier has completed yet, such
+        as the current day, is read from the finest tier still holding it.
+        """
+        now = time.time() if now is None else now
+        complete = self.load_state()["complete"]
+
+        def retained(tier, at):
+            return tier.retention is None or at >= now - tier.retention
+
+        def fallback(at):
+            candidates = [tier for tier in self.tiers if retained(tier, at)]
+            if candidates:
+                return min(candidates, key=lambda tier: tier.resolution)
+            return max(self.tiers, key=lambda tier: float('inf') if tier.retention is None else tier.retention)
+
+        finest = fallback(start)
+        pos = start // finest.resolution * finest.resolution
+        parts = []
+        while pos < end:
+            part = None
+            coarse_first = sorted(self.tiers, key=lambda tier: tier.resolution, reverse=True)
+            for i, tier in enumerate(coarse_first):
+                if pos % tier.resolution or not retained(tier, pos):
+                    continue
+                limit = min(end, complete.get(tier.name, 0)) // tier.resolution * tier.resolution
+                if limit <= pos:
+                    continue
+                # Hand over to a coarser tier at its next bucket boundary
+                for coarser in coarse_first[:i]:
+                    limit = min(limit, (pos // coarser.resolution + 1) * coarser.resolution)
+                part = (tier, pos, limit)
+                break
+            if part is None:
+                part = (fallback(pos), pos, end)
+            if parts and parts[-1][0] == part[0] and parts[-1][2] == part[1]:
+                part = (part[0], parts.pop()[1], part[2])
+            parts.append(part)
+            pos = part[2]
+        return parts
+
+    def query(self, start, end, now=None):
+        """Return (tiers, rows) with all aggregates of the time range."""
+        parts = self.plan(start, end, now)
+        rows = []
+        for tier, first, last in parts:
+            first = first // tier.resolution * tier.resolution
+            for part_start, path in self._partitions(tier):
+                if part_start + tier.partition <= first or part_start >= last:
+                    continue
+                for key, counters in self._read(path).items():
+                    if first <= key.bucket < last:
+                        rows.append(Row(*(list(key) + counters)))
+        return [part[0] for part in parts], sorted(rows)
+
+
+def closed_segments(segment_dir, length, now=None, grace=5):
+    """Yield (start, path) of raw segments main.py no longer writes to."""
+    now = time.time() if now is None else now
+    for name in sorted(os.listdir(segment_dir)):
+        base, ext = os.path.splitext(name)
+        if ext != ".json" or not base.isdigit():
+            continue
+        start = int(base)
+        if start + length + grace <= now:
+            yield start, os.path.join(segment_dir, name)
+
+
+class RollupWorker(threading.Thread):
+    """Background thread compacting closed raw segments into the rollup tiers."""
+
+    def __init__(self, segment_dir, segment_length, store,
+                 raw_retention=RAW_RETENTION, interval=30, grace=5):
+        super().__init__(daemon=True)
+        self.segment_dir = segment_dir
+        self.segment_length = segment_length
+        self.store = store
+        self.store.create()
+        self.raw_retention = raw_retention
+        self.interval = interval
+        self.grace = grace
+        self._stop_event = threading.Event()
+
+    def _expired(self, start, now):
+        return self.raw_retention is not None and \
+            start + self.segment_length <= now - self.raw_retention
+
+    def run_once(self, now=None):
+        now = time.time() if now is None else now
+        state = self.store.load_state()
+        self.store.recover(state)
+
+        # Segments close in order of their start, so everything up to
+        # rolled_up_to has been handled already
+        for start, path in closed_segments(self.segment_dir, self.segment_length,
+                                           now, self.grace):
+            if start > state["rolled_up_to"]:
+                try:
+                    with open(path, 'r') as fh:
+                        exports = json.loads(fh.read())
+                    totals = aggregate(exports, self.store.tiers[0].resolution)
+                except (IOError, ValueError, TypeError, AttributeError) as e:
+                    # A crash of main.py mid-write leaves a truncated segment,
+                    # move it aside so later segments still get rolled up
+                    logging.warning("Quarantining segment {}: {}".format(path, e))
+                    os.replace(path, path + ".bad")
+                    continue
+                self.store.merge(start, totals, state)
+                logging.debug("Rolled up segment {}".format(path))
+
+            if self._expired(start, now):
+                os.remove(path)
+
+        # Quarantined segments follow the raw retention as well
+        for name in os.listdir(self.segment_dir):
+            base = name[:-len(".json.bad")]
+            if name.endswith(".json.bad") and base.isdigit() and self._expired(int(base), now):
+                os.remove(os.path.join(self.segment_dir, name))
+
+        # Buckets ending before the oldest open segment can no longer change
+        self.store.compact(state, now - self.segment_length - self.grace)
+        self.store.expire(state, now)
+
+    def run(self):
+        while not self._stop_event.is_set():
+            try:
+                self.run_once()
+            except (IOError, ValueError) as e:
+                logging.warning("Rollup failed: {}".format(e))
+            self._stop_event.wait(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
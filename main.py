@@ -290,6 +290,8 @@ except ImportError:
     logging.warn("Since PwC:(NetHunt™) is not installed as package, running from source directly.")
     from src.nethunt.NetHunt_Collector import ExportPacket
 
+from NetHunt_Rollup import RAW_RETENTION, RollupStore, RollupWorker
+
 parser = argparse.ArgumentParser(description='PwC:(NetHunt™)')
 parser.add_argument('--host', type=str, default='',
                     help='Please provide IP address of the collector')
@@ -300,12 +302,23 @@ parser.add_argument('--file', '-o', type=str, dest='output_file',
                     help='In order to export to a JSON file')
 parser.add_argument('--debug', '-D', action='store_true',
                     help='Debugging mode for the output')
+parser.add_argument('--segment-dir', type=str, dest='segment_dir', default=None,
+                    help='Write raw flows into rotating <start>.json segments in this directory instead of a single file')
+parser.add_argument('--segment-length', type=int, default=None,
+                    help='Length of a raw segment in seconds. Defaults set at 300')
+parser.add_argument('--rollup-dir', type=str, default=None,
+                    help='Compact closed segments into 1m/1h/1d rollup tiers in this directory')
+parser.add_argument('--raw-retention', type=int, default=None,
+                    help='Delete rolled up raw segments older than this many seconds. Defaults set at 7 days')
 
 class SoftflowUDPHandler(socketserver.BaseRequestHandler):
     # We need to save the templates our NetFlow device
     # send over time. Templates are not resended every
     # time a flow is sent to the collector.
     TEMPLATES = {}
+    # Rotate raw output into <start>.json segments if set
+    segment_dir = None
+    segment_length = 300
 
     @classmethod
     def get_server(cls, host, port):
@@ -317,12 +330,24 @@ class SoftflowUDPHandler(socketserver.BaseRequestHandler):
     def set_output_file(cls, path):
         cls.output_file = path
 
+    @classmethod
+    def set_segment_dir(cls, path, length):
+        cls.segment_dir = path
+        cls.segment_length = length
+
+    def current_output_file(self):
+        if self.segment_dir is None:
+            return self.output_file
+        start = int(time.time()) // self.segment_length * self.segment_length
+        return os.path.join(self.segment_dir, "{}.json".format(start))
+
     def handle(self):
-        if not os.path.exists(self.output_file):
-            with open(self.output_file, 'w') as fh:
+        output_file = self.current_output_file()
+        if not os.path.exists(output_file):
+            with open(output_file, 'w') as fh:
                 fh.write(json.dumps({}))
 
-        with open(self.output_file, 'r') as fh:
+        with open(output_file, 'r') as fh:
             existing_data = json.loads(fh.read())
 
         data = self.request[0]
@@ -337,7 +362,7 @@ class SoftflowUDPHandler(socketserver.BaseRequestHandler):
         # Append new flows
         existing_data[time.time()] = [flow.data for flow in export.flows]
 
-        with open(self.output_file, 'w') as fh:
+        with open(output_file, 'w') as fh:
             fh.write(json.dumps(existing_data))
 
 
@@ -345,11 +370,34 @@ class SoftflowUDPHandler(socketserver.BaseRequestHandler):
 if __name__ == "__main__":
     args = parser.parse_args()
     SoftflowUDPHandler.set_output_file(args.output_file)
+    if args.segment_dir:
+        if args.segment_length is None:
+            args.segment_length = SoftflowUDPHandler.segment_length
+        elif args.segment_length <= 0:
+            parser.error("--segment-length must be a positive number of seconds")
+        os.makedirs(args.segment_dir, exist_ok=True)
+        SoftflowUDPHandler.set_segment_dir(args.segment_dir, args.segment_length)
+    elif args.rollup_dir:
+        parser.error("--rollup-dir requires --segment-dir")
+    elif args.segment_length is not None:
+        parser.error("--segment-length requires --segment-dir")
+    if args.raw_retention is not None and not args.rollup_dir:
+        parser.error("--raw-retention requires --rollup-dir")
+    elif args.raw_retention is not None and args.raw_retention < 0:
+        parser.error("--raw-retention must not be negative")
     server = SoftflowUDPHandler.get_server(args.host, args.port)
 
     if args.debug:
         logging.getLogger().setLevel(logging.DEBUG)
 
+    if args.rollup_dir:
+        if args.raw_retention is None:
+            args.raw_retention = RAW_RETENTION
+        worker = RollupWorker(args.segment_dir, args.segment_length,
+                              RollupStore(args.rollup_dir),
+                              raw_retention=args.raw_retention)
+        worker.start()
+
     try:
         logging.debug("Starting PwC:(NetHunt™), the NetFlow listener")
         server.serve_forever(poll_interval=0.5)
@@ -5,8 +5,8 @@ import socket, select, struct
 class Flow(object):
 	# Virtual base class
 	LENGTH = 0
-	def __init__(self, data):
-		if len(data) != self.LENGTH:
+	def __init__(self, data, offset=0):
+		if len(data) - offset < self.LENGTH:
 			raise ValueError, "Short flow"
 
 	def _int_to_ipv4(self, addr):
@@ -17,17 +17,18 @@ class Flow(object):
 class Header(object):
 	# Virtual base class
 	LENGTH = 0
-	def __init__(self, data):
-		if len(data) != self.LENGTH:
+	def __init__(self, data, offset=0):
+		if len(data) - offset < self.LENGTH:
 			raise ValueError, "Short flow header"
 
 class Header1(Header):
-	LENGTH = struct.calcsize("!HHIII")
-	def __init__(self, data):
-		if len(data) != self.LENGTH:
-			raise ValueError, "Short flow header"
-			
-		_nh = struct.unpack("!HHIII", data)
+	FORMAT = struct.Struct("!HHIII")
+	LENGTH = FORMAT.size
+	def __init__(self, data, offset=0):
+		Header.__init__(self, data, offset)
+
+		# Unpack straight out of the receive buffer, no slicing
+		_nh = self.FORMAT.unpack_from(data, offset)
 		self.version = _nh[0]
 		self.num_flows = _nh[1]
 		self.sys_uptime = _nh[2]
@@ -44,12 +45,12 @@ class Header1(Header):
 		return ret
 
 class Flow1(Flow):
-	LENGTH = struct.calcsize("!IIIHHIIIIHHHBBBBBBI")
-	def __init__(self, data):
-		if len(data) != self.LENGTH:
-			raise ValueError, "Short flow"
-			
-		_ff = struct.unpack("!IIIHHIIIIHHHBBBBBBI", data)
+	FORMAT = struct.Struct("!IIIHHIIIIHHHBBBBBBI")
+	LENGTH = FORMAT.size
+	def __init__(self, data, offset=0):
+		Flow.__init__(self, data, offset)
+
+		_ff = self.FORMAT.unpack_from(data, offset)
 		self.src_addr = self._int_to_ipv4(_ff[0])
 		self.dst_addr = self._int_to_ipv4(_ff[1])
 		self.next_hop = self._int_to_ipv4(_ff[2])
@@ -76,20 +77,23 @@ class NetFlowPacket:
 	FLOW_TYPES = {
 		1 : (Header1, Flow1),
 	}
+	VERSION = struct.Struct("!H")
 	def __init__(self, data):
+		# data may be any buffer; a memoryview over the receive
+		# buffer lets headers and flows be unpacked in place.
 		if len(data) < 16:
 			raise ValueError, "Short packet"
-		_nf = struct.unpack("!H", data[:2])
+		_nf = self.VERSION.unpack_from(data, 0)
 		self.version = _nf[0]
 
-		if not self.version in self.FLOW_TYPES.keys():
+		if not self.version in self.FLOW_TYPES:
 			raise RuntimeWarning, \
 			    "NetFlow version %d is not yet implemented" % \
 			    self.version
 		hdr_class = self.FLOW_TYPES[self.version][0]
 		flow_class = self.FLOW_TYPES[self.version][1]
 
-		self.hdr = hdr_class(data[:hdr_class.LENGTH])
+		self.hdr = hdr_class(data, 0)
 
 		if len(data) - self.hdr.LENGTH != \
 		   (self.hdr.num_flows * flow_class.LENGTH):
@@ -98,8 +102,7 @@ class NetFlowPacket:
 		self.flows = []
 		for n in range(self.hdr.num_flows):
 			offset = self.hdr.LENGTH + (flow_class.LENGTH * n)
-			flow_data = data[offset:offset + flow_class.LENGTH]
-			self.flows.append(flow_class(flow_data))
+			self.flows.append(flow_class(data, offset))
 
 	def __str__(self):
 		ret = str(self.hdr)
@@ -125,12 +128,17 @@ for addr in addrs:
 
 	print "listening on [%s]:%d" % (addr[4][0], addr[4][1])
 
+# Preallocated receive buffer, reused for every datagram. Packets are
+# parsed through a memoryview so no per-datagram copy is made.
+buf = bytearray(8192)
+view = memoryview(buf)
+
 while 1:
 	(rlist, wlist, xlist) = select.select(socks, [], socks)
 
 	for sock in rlist:
-		(data, addrport) = sock.recvfrom(8192)
+		(nbytes, addrport) = sock.recvfrom_into(buf)
 		print "Received flow packet from %s:%d" % addrport
-		print NetFlowPacket(data)
+		print NetFlowPacket(view[:nbytes])
 
 